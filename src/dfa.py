@@ -1,43 +1,323 @@
 # src/dfa.py
-from state import State
-
-def epsilon_closure(states):
-    stack = list(states)
-    closure = set(states)
-    while stack:
-        state = stack.pop()
-        for next_state in state.transitions.get('ε', []):
-            if next_state not in closure:
-                closure.add(next_state)
-                stack.append(next_state)
-    return closure
-
-def move(states, char):
-    next_states = set()
-    for state in states:
-        next_states.update(state.transitions.get(char, []))
+from array import array
+
+# Transition tables are arrays of state ids. The largest value of the array's typecode marks a
+# DEAD transition and the value below it an UNKNOWN one that has not been computed yet.
+MAX_VALUES = {'B': 0xFF, 'H': 0xFFFF, 'i': 0x7FFFFFFF}
+
+# Upper bound on the number of transitions a lazily built DFA keeps cached
+MAX_CACHED_TRANSITIONS = 1 << 16
+# Largest DFA that is built completely and minimized up front instead of being built lazily
+MAX_DENSE_STATES = 1 << 10
+
+class DFA:
+    def __init__(self, sources, targets, classes, start_mask, final_mask, class_ids, max_states=None):
+        # trans[state][input_class] is the next state id, dead, or unknown until step() computes it.
+        # sources/targets/classes are the move_closures() tables for the characters the input classes
+        # stand for; class_ids maps the code point of every alphabet character to its input class,
+        # and dead_class is the extra column, DEAD in every row, that any other character maps to.
+        # byte_class is the same mapping as a bytes.translate() table, or None when a class id does
+        # not fit in a byte.
+        self.sources = sources
+        self.targets = targets
+        self.classes = classes
+        self.start_mask = start_mask
+        self.final_mask = final_mask
+        self.class_ids = class_ids
+        self.dead_class = len(sources)
+        byte_classes = [class_ids.get(code, self.dead_class) for code in range(256)]
+        self.byte_class = bytes(byte_classes) if max(byte_classes) <= 0xFF else None
+        self.max_states = max_states
+        self.complete = False
+        self.typecode = 'i'
+        self.dead = MAX_VALUES[self.typecode]
+        self.unknown = self.dead - 1
+        self.start = 0
+        self.masks = []  # masks[state] is the bitmask of NFA states the DFA state stands for
+        self.ids = {}
+        self.trans = []
+        self.final = []
+        self.flush()
+
+    def flush(self):
+        # Forgets every cached state but the start state; the lists are cleared in place so
+        # references held by a running scan stay valid
+        self.masks.clear()
+        self.ids.clear()
+        self.trans.clear()
+        self.final.clear()
+        self.add_state(self.start_mask)
+        self.final[self.start] = False  # The start state never accepts, so the empty string is not matched
+
+    def add_state(self, mask):
+        state = self.ids[mask] = len(self.masks)
+        self.masks.append(mask)
+        # Only the input classes some NFA state in mask moves on need subset construction;
+        # every other transition is DEAD from the start
+        present = 0
+        for i in iter_bits(mask):
+            present |= self.classes[i]
+        row = array(self.typecode, [self.dead]) * (self.dead_class + 1)
+        for input_class in iter_bits(present):
+            row[input_class] = self.unknown
+        self.trans.append(row)
+        self.final.append(bool(mask & self.final_mask))
+        return state
+
+    def step(self, state, input_class):
+        # Runs subset construction for one transition, caches it and returns the next state id.
+        # When the cache is full it is flushed first (RE2-style), so the returned id is always valid
+        # but earlier ids may not be.
+        next_mask = move_closure(self.masks[state], self.sources[input_class], self.targets[input_class])
+        if not next_mask:
+            next_state = self.dead
+        else:
+            next_state = self.ids.get(next_mask)
+            if next_state is None:
+                if self.max_states is not None and len(self.masks) >= self.max_states:
+                    self.flush()
+                    return self.add_state(next_mask)
+                next_state = self.add_state(next_mask)
+        self.trans[state][input_class] = next_state
+        return next_state
+
+    def expand(self, max_states=None):
+        # Computes every transition reachable from the start state and returns True, or returns
+        # False as soon as the DFA would need more than max_states states (or more than its cache
+        # holds), leaving it lazily built. States are numbered in the order they are found, so
+        # walking the ids in order is a breadth-first search with the id list as its queue; only
+        # the UNKNOWN entries add_state() left need any work.
+        limits = [n for n in (max_states, self.max_states) if n is not None]
+        limit = min(limits) if limits else None
+        state = 0
+        while state < len(self.masks):
+            row = self.trans[state]
+            for input_class in range(self.dead_class):
+                if row[input_class] == self.unknown:
+                    if limit is not None and len(self.masks) >= limit:
+                        return False
+                    self.step(state, input_class)
+            state += 1
+        self.complete = True
+        return True
+
+    def minimize(self):
+        # Merges equivalent states by partition refinement: states start out split by finality,
+        # and a block is split whenever its members move to different blocks on some input class,
+        # until no block splits. Blocks are numbered by their first state, so the start state
+        # stays 0, and the quotient table is stored with the smallest typecode its ids fit in.
+        # Only valid on a complete DFA (see expand()).
+        dead = self.dead
+        block = [1 if is_final else 0 for is_final in self.final]
+        block_count = len(set(block))
+        while True:
+            signatures = {}
+            next_block = []
+            for state, row in enumerate(self.trans):
+                signature = (block[state], tuple(dead if target == dead else block[target] for target in row))
+                next_block.append(signatures.setdefault(signature, len(signatures)))
+            block = next_block
+            if len(signatures) == block_count:
+                break
+            block_count = len(signatures)
+
+        typecode = next(typecode for typecode in 'BHi' if block_count <= MAX_VALUES[typecode] - 1)
+        self.typecode = typecode
+        self.dead = MAX_VALUES[typecode]
+        self.unknown = self.dead - 1
+        trans = [None] * block_count
+        final = [False] * block_count
+        masks = [0] * block_count
+        for state, row in enumerate(self.trans):
+            if trans[block[state]] is None:
+                trans[block[state]] = array(typecode, (self.dead if target == dead else block[target] for target in row))
+                final[block[state]] = self.final[state]
+                masks[block[state]] = self.masks[state]
+        self.ids = {mask: block[state] for state, mask in enumerate(self.masks)}
+        self.trans[:] = trans
+        self.final[:] = final
+        self.masks[:] = masks
+        return self
+
+def successors(state):
+    next_states = [next_state for targets in state.transitions.values() for next_state in targets]
+    if state.default_transition is not None:
+        next_states.append(state.default_transition)
     return next_states
 
-def nfa_to_dfa(nfa, alphabet):
-    initial_closure = epsilon_closure([nfa.start_state])
-    dfa_states = {frozenset(initial_closure): State()}
-    unmarked_states = [initial_closure]
-    dfa_start_state = dfa_states[frozenset(initial_closure)]
-
-    while unmarked_states:
-        current_states = unmarked_states.pop()
-        current_closure = epsilon_closure(current_states)
-
-        for char in alphabet:
-            if char == 'ε':
-                continue
-            next_closure = epsilon_closure(move(current_closure, char))
-            if not next_closure:
-                continue
-            frozen_closure = frozenset(next_closure)
-            if frozen_closure not in dfa_states:
-                dfa_states[frozen_closure] = State(is_final=any(state.is_final for state in next_closure))
-                unmarked_states.append(next_closure)
-            dfa_states[frozenset(current_closure)].transitions[char] = [dfa_states[frozen_closure]]
-
-    return dfa_start_state
+def number_states(start_state):
+    # Lists every state reachable from start_state; a state's id is its position in the list
+    states = [start_state]
+    ids = {start_state: 0}
+    for state in states:
+        for next_state in successors(state):
+            if next_state not in ids:
+                ids[next_state] = len(states)
+                states.append(next_state)
+    return states, ids
+
+def live_states(states, ids):
+    # Bitmask of the states from which a final state can be reached, found by a reverse
+    # breadth-first search from the final states
+    predecessors = [[] for _ in states]
+    for i, state in enumerate(states):
+        for next_state in successors(state):
+            predecessors[ids[next_state]].append(i)
+
+    live = [i for i, state in enumerate(states) if state.is_final]
+    live_mask = sum(1 << i for i in live)
+    for i in live:
+        for j in predecessors[i]:
+            if not live_mask & (1 << j):
+                live_mask |= 1 << j
+                live.append(j)
+    return live_mask
+
+def iter_bits(mask):
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+def epsilon_closures(states, ids):
+    # Returns ec_mask, where ec_mask[i] is the ε-closure of states[i] as a bitmask of state ids.
+    # Tarjan's algorithm collapses ε-cycles into SCCs and finishes each SCC after all SCCs it reaches,
+    # so a closure is its SCC's members plus the (already known) closures of its ε-successors.
+    eps = [[ids[next_state] for next_state in state.transitions.get('ε', [])] for state in states]
+    index = [-1] * len(states)
+    lowlink = [0] * len(states)
+    on_stack = [False] * len(states)
+    scc_stack = []
+    ec_mask = [0] * len(states)
+    counter = 0
+
+    for root in range(len(states)):
+        if index[root] >= 0:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        scc_stack.append(root)
+        on_stack[root] = True
+        work = [(root, iter(eps[root]))]
+
+        while work:
+            i, pending = work[-1]
+            for j in pending:
+                if index[j] < 0:
+                    index[j] = lowlink[j] = counter
+                    counter += 1
+                    scc_stack.append(j)
+                    on_stack[j] = True
+                    work.append((j, iter(eps[j])))
+                    break
+                if on_stack[j]:
+                    lowlink[i] = min(lowlink[i], index[j])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[i])
+                if lowlink[i] == index[i]:
+                    members = []
+                    closure = 0
+                    while True:
+                        member = scc_stack.pop()
+                        on_stack[member] = False
+                        members.append(member)
+                        closure |= 1 << member
+                        if member == i:
+                            break
+                    for member in members:
+                        for j in eps[member]:
+                            closure |= ec_mask[j]
+                    for member in members:
+                        ec_mask[member] = closure
+
+    return ec_mask
+
+def move_closures(states, ids, ec_mask, chars):
+    # Transposes the NFA's transitions into one table per character of chars, where None stands
+    # for any character that no state mentions: sources[k] is the bitmask of states with a
+    # transition on chars[k], and targets[k][i] is the ε-closure of the states that states[i]
+    # reaches on it. classes[i] is the bitmask of the k that states[i] has a transition on.
+    sources = [0] * len(chars)
+    targets = [[0] * len(states) for _ in chars]
+    classes = [0] * len(states)
+    for i, state in enumerate(states):
+        for k, char in enumerate(chars):
+            next_states = state.transitions.get(char)
+            if next_states is None:
+                if state.default_transition is None or char in state.negated_chars:
+                    continue
+                next_states = [state.default_transition]
+            mask = 0
+            for next_state in next_states:
+                mask |= ec_mask[ids[next_state]]
+            if not mask:
+                continue  # Every target is dead
+            sources[k] |= 1 << i
+            targets[k][i] = mask
+            classes[i] |= 1 << k
+    return sources, targets, classes
+
+def move_closure(mask, sources, targets):
+    # Only the states that actually have a transition on the character are visited
+    next_mask = 0
+    for i in iter_bits(mask & sources):
+        next_mask |= targets[i]
+    return next_mask
+
+def nfa_to_dfa(nfa, alphabet, lazy=False):
+    # With lazy set, only the start state is built up front and further states are computed on
+    # demand by DFA.step(), with at most MAX_CACHED_TRANSITIONS transitions cached at a time
+    states, ids = number_states(nfa.start_state)
+    # Closures only keep states that can still reach a final state, so a DFA state that can
+    # never accept has an empty mask and becomes DEAD, ending the scan right away
+    live_mask = live_states(states, ids)
+    ec_mask = [mask & live_mask for mask in epsilon_closures(states, ids)]
+    final_mask = sum(1 << i for i, state in enumerate(states) if state.is_final)
+
+    # Only characters the NFA mentions, either as a transition or as an exception to a default
+    # transition, can behave differently from one another. Each of them gets its own input class
+    # (a column of the transition table); the remaining alphabet characters share one class that
+    # only follows default transitions, and every other character shares the last column, which
+    # is always DEAD.
+    mentioned = set()
+    for state in states:
+        mentioned.update(state.transitions)
+        if state.default_transition is not None:
+            mentioned.update(state.negated_chars)
+    chars = sorted(char for char in mentioned if char in alphabet and char != 'ε')
+    other_chars = []
+    if any(state.default_transition is not None for state in states):
+        other_chars = [char for char in alphabet if char not in mentioned and char != 'ε']
+    class_ids = {ord(char): class_id for class_id, char in enumerate(chars)}
+    if other_chars:
+        class_ids.update(dict.fromkeys(map(ord, other_chars), len(chars)))
+        chars.append(None)
+    dead_class = len(chars)
+
+    sources, targets, classes = move_closures(states, ids, ec_mask, chars)
+    if lazy:
+        max_states = max(2, MAX_CACHED_TRANSITIONS // (dead_class + 1))
+        return DFA(sources, targets, classes, ec_mask[0], final_mask, class_ids, max_states)
+    dfa = DFA(sources, targets, classes, ec_mask[0], final_mask, class_ids)
+    dfa.expand()
+    return dfa.minimize()
+
+def start_classes(dfa):
+    # Input classes that can leave the start state. Transitions the DFA has not built yet are
+    # computed with step(); everything else is read straight from the table.
+    classes = set()
+    for input_class in range(dfa.dead_class):
+        next_state = dfa.trans[dfa.start][input_class]
+        if next_state == dfa.unknown:
+            next_state = dfa.step(dfa.start, input_class)
+        if next_state != dfa.dead:
+            classes.add(input_class)
+    return classes
+
+def first_chars(dfa):
+    # Characters that can leave the start state; every non-empty match begins with one of them
+    classes = start_classes(dfa)
+    return sorted(chr(code) for code, input_class in dfa.class_ids.items() if input_class in classes)
@@ -15,3 +15,8 @@ print(findall("a", "aaab", alphabet))  # ['a', 'a', 'a']
 print(search("a", "aaab", alphabet))  # 0
 print(split("a", "aaab", alphabet))  # ['', '', '', 'b']
 print(sub("a", "x", "aaab", alphabet))  # 'xxxb'
+
+# Characters outside latin-1 work like any other alphabet character
+wide_alphabet = set('abā')
+print(match("ā", "ā", wide_alphabet))  # True
+print(findall("^a", "aāb", wide_alphabet))  # ['ā', 'b']
@@ -51,10 +51,15 @@ def zero_or_one_nfa(nfa):
     nfa.accept_state.transitions['ε'] = [accept_state]
     return NFA(start_state, accept_state)
 
-def negate_nfa(nfa, alphabet):
+def negate_nfa(nfa):
     start_state = State()
     accept_state = State(is_final=True)
-    for char in alphabet:
-        if char not in nfa.start_state.transitions:
-            start_state.transitions[char] = [accept_state]
+    if nfa.start_state.default_transition is not None:
+        # Negating a negation: the complement is the finite set of characters it excluded
+        for char in nfa.start_state.negated_chars:
+            if char != 'ε':
+                start_state.transitions[char] = [accept_state]
+    else:
+        start_state.default_transition = accept_state
+        start_state.negated_chars = set(nfa.start_state.transitions.keys())
     return NFA(start_state, accept_state)
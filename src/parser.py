@@ -1,42 +1,60 @@
 # src/parser.py
+SPECIAL_CHARS = '\\|*+?()[]^$'
+
+# Maps every special character (and NUL, the marker itself) to NUL, so that str.find('\0')
+# on the translated pattern jumps straight to the next token boundary
+_MARK_SPECIALS = str.maketrans(dict.fromkeys(SPECIAL_CHARS + '\0', '\0'))
+
+def tokenize(pattern):
+    # Yields (kind, text) tokens: 'literal' runs, 'escape'd characters, 'charset' brackets and
+    # single 'operator' characters
+    marks = pattern.translate(_MARK_SPECIALS)
+    i = 0
+    while i < len(pattern):
+        j = marks.find('\0', i)
+        while j >= 0 and pattern[j] == '\0':
+            j = marks.find('\0', j + 1)
+        if j < 0:
+            j = len(pattern)
+        if j > i:
+            yield 'literal', pattern[i:j]
+        if j == len(pattern):
+            break
+
+        char = pattern[j]
+        if char == '\\':
+            if j + 1 < len(pattern):
+                yield 'escape', pattern[j + 1]
+            i = j + 2
+        else:
+            yield ('charset' if char in '[]' else 'operator'), char
+            i = j + 1
+
 def parse_regex(pattern):
-    operators = {'|', '*', '+', '?', '(', ')', '[', ']', '^', '$'}
     output = []
     operators_stack = []
-    escaped = False
     char_set = False
 
-    for char in pattern:
-        if escaped:
-            output.append(char)
-            escaped = False
-        elif char == '\\':
-            escaped = True
-        elif char == '[':
-            char_set = True
-            output.append(char)
-        elif char == ']':
-            char_set = False
-            output.append(char)
+    for kind, text in tokenize(pattern):
+        if kind == 'literal':
+            output.extend(text)
+        elif kind == 'escape':
+            output.append(text)
+        elif kind == 'charset':
+            char_set = text == '['
+            output.append(text)
         elif char_set:
-            output.append(char)
-        elif char in operators:
-            if char == '(' or char == '[':
-                operators_stack.append(char)
-            elif char == ')':
-                while operators_stack and operators_stack[-1] != '(':
-                    output.append(operators_stack.pop())
-                operators_stack.pop()  # Remove '('
-            elif char == ']':
-                while operators_stack and operators_stack[-1] != '[':
-                    output.append(operators_stack.pop())
-                operators_stack.pop()  # Remove '['
-            else:
-                while operators_stack and precedence(operators_stack[-1]) >= precedence(char):
-                    output.append(operators_stack.pop())
-                operators_stack.append(char)
+            output.append(text)
+        elif text == '(':
+            operators_stack.append(text)
+        elif text == ')':
+            while operators_stack and operators_stack[-1] != '(':
+                output.append(operators_stack.pop())
+            operators_stack.pop()  # Remove '('
         else:
-            output.append(char)
+            while operators_stack and precedence(operators_stack[-1]) >= precedence(text):
+                output.append(operators_stack.pop())
+            operators_stack.append(text)
 
     while operators_stack:
         output.append(operators_stack.pop())
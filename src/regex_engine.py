@@ -1,10 +1,20 @@
 # src/regex_engine.py
+from functools import lru_cache, partial
+
 from nfa import create_basic_nfa, concatenate_nfa, alternate_nfa, kleene_star_nfa, one_or_more_nfa, zero_or_one_nfa, \
     negate_nfa, NFA
-from dfa import nfa_to_dfa
+from dfa import nfa_to_dfa, first_chars, start_classes, MAX_DENSE_STATES
 from parser import parse_regex
 from state import State
 
+# Largest set of possible first characters that search/findall still prefilter for
+PREFILTER_MAX_CHARS = 64
+# Number of input classes the prefilter marks at once; each further chunk doubles in size
+PREFILTER_CHUNK = 1 << 12
+# Largest complete DFA that gets a generated scan function. The generated if/elif chain tests
+# states one after another, so past about this size the table walk in _dfa_scan is faster.
+CODEGEN_MAX_STATES = 6
+
 def build_nfa(parsed_regex, alphabet):
     stack = []
     for char in parsed_regex:
@@ -48,7 +58,7 @@ def build_nfa(parsed_regex, alphabet):
                 if len(stack) < 1:
                     raise ValueError(f"Invalid negation operation in regex: {parsed_regex}")
                 nfa = stack.pop()
-                stack.append(negate_nfa(nfa, alphabet))
+                stack.append(negate_nfa(nfa))
         elif char == '$':
             if len(stack) == 1:
                 nfa = stack.pop()
@@ -77,52 +87,183 @@ def regex_to_nfa(pattern, alphabet):
     parsed_regex = parse_regex(pattern)
     return build_nfa(parsed_regex, alphabet)
 
-def match(pattern, string, alphabet):
+@lru_cache(maxsize=128)
+def _compile(pattern, alphabet):
+    # alphabet must be hashable (a frozenset) so the compiled DFA can be cached per pattern
     nfa = regex_to_nfa(pattern, alphabet)
-    dfa_start_state = nfa_to_dfa(nfa, alphabet)
+    dfa = nfa_to_dfa(nfa, alphabet, lazy=True)
+    # Small automata are built completely and minimized; larger ones keep being built lazily
+    if dfa.expand(MAX_DENSE_STATES):
+        dfa.minimize()
+    if dfa.complete and len(dfa.trans) <= CODEGEN_MAX_STATES:
+        scan = _codegen_scan(dfa)
+    else:
+        scan = partial(_dfa_scan, dfa)
+    # Maps every input class of a bytes buffer to 1 if it can start a match, else 0
+    start_table = None
+    if dfa.byte_class is not None:
+        classes = start_classes(dfa)
+        start_table = bytes(int(input_class in classes) for input_class in range(256))
+    return dfa, first_chars(dfa), start_table, scan
+
+def _encode(string, dfa):
+    # Maps every character to its DFA input class. Latin-1 strings are mapped in C with
+    # bytes.translate; anything else falls back to a list of class ids.
+    if dfa.byte_class is not None:
+        try:
+            return string.encode('latin-1').translate(dfa.byte_class)
+        except UnicodeEncodeError:
+            pass
+    class_ids = dfa.class_ids
+    dead_class = dfa.dead_class
+    return [class_ids.get(code, dead_class) for code in map(ord, string)]
+
+def _prefilter(string, buf, chars, start_table):
+    # Returns find(i): the first position >= i that holds one of chars, or -1.
+    # The scanning runs in C, so runs of characters that cannot start a match are skipped
+    # without touching the DFA: a single character is found with str.find (memchr), and for a
+    # small class the encoded buffer is translated through start_table, which marks every
+    # position that can start a match with 1. The marks are built lazily, in growing chunks,
+    # so a search that succeeds early does not translate the whole buffer.
+    if len(chars) == 1:
+        char = chars[0]
+        return lambda i: string.find(char, i)
+    if len(chars) > PREFILTER_MAX_CHARS:
+        return lambda i: i if i < len(string) else -1
+
+    if isinstance(buf, list):
+        # Non-latin-1 input: mark the str itself
+        table = dict.fromkeys(map(ord, set(string)), '\0')
+        table.update(dict.fromkeys(map(ord, chars), '\1'))
+        marks = string.translate(table)
+        return lambda i: marks.find('\1', i)
+
+    marks = bytearray()
+
+    def find(i):
+        while True:
+            j = marks.find(1, i)
+            if j >= 0 or len(marks) == len(buf):
+                return j
+            start = len(marks)
+            marks.extend(buf[start:start + max(PREFILTER_CHUNK, start)].translate(start_table))
+            i = max(i, start)
+
+    return find
 
-    current_state = dfa_start_state
-    for char in string:
-        if char in current_state.transitions:
-            current_state = current_state.transitions[char][0]
+def _dfa_scan(dfa, buf, pos, first=False):
+    # Walk the DFA over buf[pos:] and return the end of the longest non-empty match
+    # (or the first one when first is set), or -1 if no match starts at pos
+    trans = dfa.trans
+    final = dfa.final
+    dead = dfa.dead
+    unknown = dfa.unknown
+    state = dfa.start
+    last_end = -1
+    for i in range(pos, len(buf)):
+        next_state = trans[state][buf[i]]
+        if next_state >= unknown:
+            if next_state == dead:
+                break
+            next_state = dfa.step(state, buf[i])
+            if next_state == dead:
+                break
+        state = next_state
+        if final[state]:
+            last_end = i + 1
+            if first:
+                break
+    return last_end
+
+def _codegen_scan(dfa):
+    # Generates a function equivalent to partial(_dfa_scan, dfa) for a small, complete DFA, with the
+    # transition table unrolled into if/elif chains on the current state and input class. For a
+    # handful of states a few integer comparisons are cheaper than two subscripts per character.
+    lines = [
+        "def scan(buf, pos, first=False):",
+        f"    state = {dfa.start}",
+        "    last_end = -1",
+        "    for i in range(pos, len(buf)):",
+        "        c = buf[i]",
+    ]
+    for state, row in enumerate(dfa.trans):
+        lines.append(f"        {'if' if state == 0 else 'elif'} state == {state}:")
+        targets = {}
+        for input_class, target in enumerate(row):
+            if target != dfa.dead:
+                targets.setdefault(target, []).append(input_class)
+        keyword = 'if'
+        for target, classes in targets.items():
+            condition = f"c == {classes[0]}" if len(classes) == 1 else f"c in {tuple(classes)}"
+            lines.append(f"            {keyword} {condition}:")
+            lines.append(f"                state = {target}")
+            if dfa.final[target]:
+                lines.append("                last_end = i + 1")
+            if all(next_state == dfa.dead for next_state in dfa.trans[target]):
+                lines.append("                break")  # No character can extend the match
+            elif dfa.final[target]:
+                lines.append("                if first:")
+                lines.append("                    break")
+            keyword = 'elif'
+        if targets:
+            lines.append("            else:")
+            lines.append("                break")
         else:
-            return False
+            lines.append("            break")
+    lines.append("    return last_end")
+
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['scan']
+
+def match(pattern, string, alphabet):
+    dfa, _, _, scan = _compile(pattern, frozenset(alphabet))
+    buf = _encode(string, dfa)
+    return scan(buf, 0) == len(buf)
 
-    return current_state.is_final
+def _finditer(pattern, string, alphabet):
+    # Yields the (start, end) span of every leftmost-longest, non-overlapping match
+    dfa, chars, start_table, scan = _compile(pattern, frozenset(alphabet))
+    buf = _encode(string, dfa)
+    find = _prefilter(string, buf, chars, start_table)
+    i = find(0)
+    while i >= 0:
+        end = scan(buf, i)
+        if end < 0:
+            i = find(i + 1)
+        else:
+            yield i, end
+            i = find(end)
 
 def findall(pattern, string, alphabet):
-    matches = []
-    for i in range(len(string)):
-        for j in range(i + 1, len(string) + 1):
-            if match(pattern, string[i:j], alphabet):
-                matches.append(string[i:j])
-    return matches
+    return [string[start:end] for start, end in _finditer(pattern, string, alphabet)]
 
 def search(pattern, string, alphabet):
-    for i in range(len(string)):
-        for j in range(i + 1, len(string) + 1):
-            if match(pattern, string[i:j], alphabet):
-                return i  # Return the starting position of the match
+    dfa, chars, start_table, scan = _compile(pattern, frozenset(alphabet))
+    buf = _encode(string, dfa)
+    find = _prefilter(string, buf, chars, start_table)
+    i = find(0)
+    while i >= 0:
+        if scan(buf, i, first=True) >= 0:
+            return i  # Return the starting position of the match
+        i = find(i + 1)
     return -1
 
 def split(pattern, string, alphabet):
-    matches = findall(pattern, string, alphabet)
     parts = []
     last_end = 0
-    for match in matches:
-        start = string.find(match, last_end)
+    for start, end in _finditer(pattern, string, alphabet):
         parts.append(string[last_end:start])
-        last_end = start + len(match)
+        last_end = end
     parts.append(string[last_end:])
     return parts
 
 def sub(pattern, repl, string, alphabet):
-    matches = findall(pattern, string, alphabet)
-    result = ""
+    parts = []
     last_end = 0
-    for match in matches:
-        start = string.find(match, last_end)
-        result += string[last_end:start] + repl
-        last_end = start + len(match)
-    result += string[last_end:]
-    return result
+    for start, end in _finditer(pattern, string, alphabet):
+        parts.append(string[last_end:start])
+        parts.append(repl)
+        last_end = end
+    parts.append(string[last_end:])
+    return ''.join(parts)
@@ -2,3 +2,6 @@ class State:
     def __init__(self, is_final=False):
         self.is_final = is_final
         self.transitions = {}
+        # Taken on any character that is neither in transitions nor in negated_chars
+        self.default_transition = None
+        self.negated_chars = set()